@@ -72,3 +72,59 @@ class PoolIterator(object):
         patches_batch = np.concatenate([sample["patches"] for sample in samples])
         targets = np.concatenate([sample["targets"] for sample in samples])
         return dict(mungos_from=mungos_from, mungos_to=mungos_to, patches=patches_batch, targets=np.array(targets))
+
+
+def _identity_collate(pool_items):
+    # The data pool already returns whole batches.
+    return pool_items
+
+
+def _seed_worker(worker_id):
+    # Every worker gets its own (but reproducible) numpy random state.
+    import torch
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
+
+class DataLoaderPoolIterator(PoolIterator):
+    """Runtime batch iterator that extracts the batches from the data pool
+    in background worker processes (through a ``torch.utils.data.DataLoader``),
+    so that building the patches overlaps with running the model on them.
+
+    Produces the same batches as a non-shuffling ``PoolIterator``. Note that
+    the MuNGOs in the batches are copies that come from the worker processes,
+    so they have to be matched to the MuNG by their ``objid``.
+    """
+
+    def __init__(self, batch_size, transform=None, num_workers=2, prefetch_factor=2):
+        super().__init__(batch_size, transform=transform, shuffle=False)
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+
+    def __call__(self, pool):
+        super().__call__(pool)
+        from torch.utils.data import DataLoader
+
+        # One "sample" of the loader is a whole batch: the pool is indexed by slices.
+        batch_slices = [slice(i_start, i_start + self.batch_size)
+                        for i_start in range(0, self.k_samples, self.batch_size)]
+        loader_kwargs = dict()
+        if self.num_workers > 0:
+            loader_kwargs.update(prefetch_factor=self.prefetch_factor, worker_init_fn=_seed_worker)
+        self.data_loader = DataLoader(pool, batch_size=None, sampler=batch_slices,
+                                      collate_fn=_identity_collate, num_workers=self.num_workers,
+                                      **loader_kwargs)
+        return self
+
+    def __iter__(self):
+        for pool_items in self.data_loader:
+            # The last batch is filled up from the beginning of the pool, like in PoolIterator
+            if len(pool_items["mungos_from"]) < self.batch_size:
+                n_missing = self.batch_size - len(pool_items["mungos_from"])
+                pool_items = self.collate_fn([pool_items, self.pool[0:n_missing]])
+
+            if self.transform is None:
+                yield pool_items
+            else:
+                yield self.transform(*pool_items)
+
+        self.epoch_counter += 1
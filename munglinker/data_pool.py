@@ -7,13 +7,14 @@ from typing import List, Tuple, Dict
 import numpy as np
 import yaml
 from PIL import Image
-from muscima.cropobject import cropobject_distance, bbox_intersection, CropObject
+from muscima.cropobject import bbox_intersection, CropObject
 from muscima.grammar import DependencyGrammar
 from muscima.graph import NotationGraph
 from muscima.io import parse_cropobject_list
 from torch.utils.data import Dataset
 from tqdm import tqdm
 
+from munglinker.mung_utils import cropobjects_to_soa, encode_class_names
 from munglinker.utils import config2data_pool_dict, load_grammar
 
 
@@ -94,7 +95,7 @@ class PairwiseMungoDataPool(Dataset):
 
         # Return the patches, targets, and the MuNGos themselves
         patches_batch = np.zeros((len(batch_entities), 3,
-                                  self.patch_height, self.patch_width))
+                                  self.patch_height, self.patch_width), dtype='float32')
         targets = np.zeros(len(batch_entities))
         mungos_from = []
         mungos_to = []
@@ -102,8 +103,8 @@ class PairwiseMungoDataPool(Dataset):
             mungo_from, mungo_to = self.all_mungo_pairs[mungo_pair_index]
             mungos_from.append(mungo_from)
             mungos_to.append(mungo_to)
-            patch = self.load_patch(image_index, mungo_from, mungo_to)
-            patches_batch[i_entity] = patch
+            # The patch is written directly into its slot of the batch
+            self.load_patch(image_index, mungo_from, mungo_to, out=patches_batch[i_entity])
 
             mungos_are_connected = mungo_to.objid in mungo_from.outlinks
             if mungos_are_connected:
@@ -159,15 +160,19 @@ class PairwiseMungoDataPool(Dataset):
 
         self.length = number_of_samples
 
-    def load_patch(self, image_index: int, mungo_from: CropObject, mungo_to: CropObject):
+    def load_patch(self, image_index: int, mungo_from: CropObject, mungo_to: CropObject, out: np.ndarray = None):
         image = self.images[image_index]
-        patch = self.get_x_patch(image, mungo_from, mungo_to)
+        patch = self.get_x_patch(image, mungo_from, mungo_to, out=out)
         return patch
 
-    def get_x_patch(self, image, mungo_from: CropObject, mungo_to: CropObject):
+    def get_x_patch(self, image, mungo_from: CropObject, mungo_to: CropObject, out: np.ndarray = None):
         """
         Assumes image is larger than patch.
 
+        :param out: If given, the patch is written into this zero-filled
+            3 * patch_height * patch_width array (e.g. a slot of a batch)
+            instead of into a newly allocated one.
+
         :return: A 3 * patch_height * patch_width array. Channel 0
             is the input image, channel 1 is the from-mungo mask,
             channel 2 is the to-mungo mask.
@@ -181,7 +186,10 @@ class PairwiseMungoDataPool(Dataset):
                      m_horz + patch_radius_h
         bbox_patch = t, l, b, r
 
-        output = np.zeros((3, (b - t), (r - l)))
+        if out is None:
+            output = np.zeros((3, (b - t), (r - l)), dtype='float32')
+        else:
+            output = out
         bbox_image = 0, 0, image.shape[0], image.shape[1]
         bbox_of_image_wrt_patch = bbox_intersection(bbox_image, bbox_patch)
         i_crop_t, i_crop_l, i_crop_b, i_crop_r = bbox_of_image_wrt_patch
@@ -245,44 +253,52 @@ class PairwiseMungoDataPool(Dataset):
 
     def get_closest_objects(self, cropobjects: List[CropObject], threshold) -> Dict[CropObject, List[CropObject]]:
         """For each pair of cropobjects, compute the closest distance between their
-        bounding boxes.
+        bounding boxes (as ``muscima.cropobject.cropobject_distance()`` does).
 
-        :returns: A dict of dicts, indexed by objid, then objid, then distance.
+        :returns: A dict that maps each cropobject to the list of cropobjects
+            that are closer than ``threshold`` (including itself), in the
+            order in which they appear in ``cropobjects``.
         """
-        close_objects = {}
-        for c in cropobjects:
-            close_objects[c] = []
-
-        for c in cropobjects:
-            for d in cropobjects:
-                distance = cropobject_distance(c, d)
-                if distance < threshold:
-                    close_objects[c].append(d)
-                    close_objects[d].append(c)
+        close_object_indices = self.get_closest_object_indices(cropobjects, threshold)
+        return {c: [cropobjects[j] for j in close_object_indices[i]] for i, c in enumerate(cropobjects)}
 
-        # Remove duplicates from lists
-        for key, neighbors in close_objects.items():
-            unique_neighbors = list(dict.fromkeys(neighbors))
-            close_objects[key] = unique_neighbors
-
-        return close_objects
+    @staticmethod
+    def get_closest_object_indices(cropobjects: List[CropObject], threshold) -> List[np.ndarray]:
+        """Same as ``get_closest_objects()``, but for each cropobject, returns
+        the array of indices (into ``cropobjects``) of the close cropobjects."""
+        boxes, _, _ = cropobjects_to_soa(cropobjects)
+        tops, lefts, bottoms, rights = boxes.T
+
+        close_object_indices = []
+        for i in range(len(cropobjects)):
+            # The distances of the i-th cropobject to all the cropobjects at once
+            vertical_distances = np.maximum(0, np.maximum(tops - bottoms[i], tops[i] - bottoms))
+            horizontal_distances = np.maximum(0, np.maximum(lefts - rights[i], lefts[i] - rights))
+            distances = np.sqrt(vertical_distances ** 2 + horizontal_distances ** 2)
+            close_object_indices.append(np.flatnonzero(distances < threshold))
+
+        return close_object_indices
 
     def get_all_neighboring_object_pairs(self, cropobjects: List[CropObject],
                                          max_object_distance,
                                          grammar=None) -> List[Tuple[CropObject, CropObject]]:
-        close_neighbors = self.get_closest_objects(cropobjects, max_object_distance)
-
-        example_pairs_dict = {}
-        for c in close_neighbors:
-            if grammar is None:
-                example_pairs_dict[c] = close_neighbors[c]
-            else:
-                example_pairs_dict[c] = [d for d in close_neighbors[c] if grammar.validate_edge(c.clsname, d.clsname)]
+        close_neighbor_indices = self.get_closest_object_indices(cropobjects, max_object_distance)
+
+        if grammar is not None:
+            # The grammar is evaluated once per pair of classes, into an
+            # allowed[from class id, to class id] matrix, which then filters
+            # the neighbors of each cropobject at once.
+            clsname_to_id, (class_ids,) = encode_class_names([c.clsname for c in cropobjects])
+            allowed = np.array([[grammar.validate_edge(clsname_from, clsname_to) for clsname_to in clsname_to_id]
+                                for clsname_from in clsname_to_id], dtype=bool)
+            allowed = allowed.reshape(len(clsname_to_id), len(clsname_to_id))
+            close_neighbor_indices = [neighbors[allowed[class_ids[i], class_ids[neighbors]]]
+                                      for i, neighbors in enumerate(close_neighbor_indices)]
 
         examples = []
-        for c in example_pairs_dict:
-            for d in example_pairs_dict[c]:
-                examples.append((c, d))
+        for c, neighbors in zip(cropobjects, close_neighbor_indices):
+            for j in neighbors.tolist():
+                examples.append((c, cropobjects[j]))
 
         # # Validate that every link from the ground-truth also has a candidate in the examples - all positives are included
         # id_to_cropobject_mapping = {cropobject.objid: cropobject for cropobject in cropobjects}
@@ -362,9 +378,14 @@ def __load_mung(filename: str, exclude_classes: List[str]):
     return mung
 
 
-def __load_image(filename: str) -> np.ndarray:
-    image = np.array(Image.open(filename).convert('1')).astype('uint8')
-    return image
+def load_image(filename: str) -> np.ndarray:
+    """Loads the image as a binary ``uint8`` array (0 = background,
+    1 = foreground). Images that are stored as binary already
+    (such as the MUSCIMA++ images) are not converted again."""
+    image = Image.open(filename)
+    if image.mode != '1':
+        image = image.convert('1')
+    return np.asarray(image, dtype='uint8')
 
 
 def __load_munglinker_data(mung_root: str, images_root: str,
@@ -417,7 +438,7 @@ def __load_munglinker_data(mung_root: str, images_root: str,
         mung = __load_mung(mung_file, exclude_classes)
         mungs.append(mung)
 
-        image = __load_image(image_file)
+        image = load_image(image_file)
         images.append(image)
 
         # This is for training on bounding boxes,
@@ -6,11 +6,11 @@ second represents the expected MuNG (ground-truth.)
 The script then computes evaluation metrics as regards
 the notation assembly stage of the OMR pipeline.
 """
-from __future__ import print_function, unicode_literals, division
 
 import copy
+import itertools
 from glob import glob
-from typing import List
+from typing import List, Tuple
 
 from muscima.cropobject import CropObject
 
@@ -21,9 +21,19 @@ import argparse
 import logging
 import os
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 
 from muscima.io import parse_cropobject_list
 
+from munglinker.mung_utils import cropobjects_to_soa, encode_class_names
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional: without it, the edge counting just runs as plain Python.
+    def njit(*args, **kwargs):
+        return lambda function: function
+
 
 ##############################################################################
 
@@ -43,52 +53,138 @@ def build_argument_parser():
     return parser
 
 
-"""
-    Check whether two objects (predicted and reference ones)
-    should be considered to match. They do iif:
-        - The class name is equal
-        - Their IoU exceeds a threshold
-"""
-
-
-def match(p_obj, r_obj, threshold=0.5):
-    if p_obj.clsname == r_obj.clsname:
-        p_box = [p_obj.left, p_obj.top, p_obj.right, p_obj.bottom]
-        r_box = [r_obj.left, r_obj.top, r_obj.right, r_obj.bottom]
-
-        box_area = ((r_box[2] - r_box[0] + 1) * (r_box[3] - r_box[1] + 1))
-        iw = (min(p_box[2], r_box[2]) - max(p_box[0], r_box[0]) + 1)
-
-        if iw > 0:
-            ih = (min(p_box[3], r_box[3]) - max(p_box[1], r_box[1]) + 1)
-
-            if ih > 0:
-                ua = np.float64((p_box[2] - p_box[0] + 1) *
-                                (p_box[3] - p_box[1] + 1) +
-                                box_area - (iw * ih)
-                                )
-
-                IoU = iw * ih / ua
-
-                if IoU > threshold:
-                    return True
+def bounding_boxes_iou(p_boxes: np.ndarray, r_boxes: np.ndarray) -> np.ndarray:
+    """Computes the IoU of every pair of the given ``(N, 4)`` and ``(M, 4)``
+    arrays of ``[top, left, bottom, right]`` boxes at once, counting the
+    bottom and right pixels as inside the box. Returns an ``(N, M)`` matrix."""
+    top_left = np.maximum(p_boxes[:, None, :2], r_boxes[None, :, :2])
+    bottom_right = np.minimum(p_boxes[:, None, 2:], r_boxes[None, :, 2:])
+    intersection_size = np.clip(bottom_right - top_left + 1, 0, None)
+    intersection = intersection_size[..., 0] * intersection_size[..., 1]
 
-    return False
+    p_area = (p_boxes[:, 2] - p_boxes[:, 0] + 1) * (p_boxes[:, 3] - p_boxes[:, 1] + 1)
+    r_area = (r_boxes[:, 2] - r_boxes[:, 0] + 1) * (r_boxes[:, 3] - r_boxes[:, 1] + 1)
+    union = p_area[:, None] + r_area[None, :] - intersection
 
+    # Non-overlapping pairs are never divided: their IoU is 0
+    return np.divide(intersection, union, out=np.zeros(intersection.shape), where=intersection > 0)
 
-def get_object_matching_pairs(predicted_objects: List[CropObject], reference_objects: List[CropObject]):
-    pairs = []
 
-    for p_obj in predicted_objects:
-        for r_obj in reference_objects:
-            if match(p_obj, r_obj):
-                pairs.append((p_obj.objid, r_obj.objid))
+def get_object_matching_indices(predicted_objects: List[CropObject], reference_objects: List[CropObject],
+                                threshold=0.5) -> np.ndarray:
+    """Matches the predicted objects to the reference objects. Two objects
+    can match iif:
+        - The class name is equal
+        - Their IoU exceeds a threshold
+    Every object matches at most one object of the other side.
+
+    :returns: The matching pairs as a ``(K, 2)`` array of
+        ``[predicted index, reference index]`` rows.
+    """
+    p_boxes, p_clsnames, _ = cropobjects_to_soa(predicted_objects)
+    r_boxes, r_clsnames, _ = cropobjects_to_soa(reference_objects)
+
+    # Objects of different classes never match, so we only compute
+    # the IoU between objects of the same class.
+    _, (p_class_ids, r_class_ids) = encode_class_names(p_clsnames, r_clsnames)
+
+    matching_indices = []
+    for class_id in np.intersect1d(p_class_ids, r_class_ids):
+        p_indices = np.flatnonzero(p_class_ids == class_id)
+        r_indices = np.flatnonzero(r_class_ids == class_id)
+        iou = bounding_boxes_iou(p_boxes[p_indices], r_boxes[r_indices])
+        # Each object matches at most one object of the other side: take
+        # the maximum-IoU assignment among the pairs above the threshold.
+        # (The pairs under the threshold are zeroed out first, so that the
+        # assignment cannot trade a valid match for several invalid ones.)
+        iou = np.where(iou > threshold, iou, 0)
+        p_matched, r_matched = linear_sum_assignment(-iou)
+        above_threshold = iou[p_matched, r_matched] > threshold
+        p_matched, r_matched = p_matched[above_threshold], r_matched[above_threshold]
+        matching_indices.append(np.stack([p_indices[p_matched], r_indices[r_matched]], axis=1))
+
+    if len(matching_indices) == 0:
+        return np.zeros((0, 2), dtype='int64')
+
+    # Restore the order in which the pairs come from iterating
+    # predicted x reference objects.
+    matching_indices = np.concatenate(matching_indices)
+    return matching_indices[np.lexsort((matching_indices[:, 1], matching_indices[:, 0]))]
+
+
+def outlinks_to_arrays(cropobjects: List[CropObject]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flattens the graph into integer arrays: the objids, and the outlinks
+    in CSR form, so that the outlinks of ``cropobjects[i]`` are
+    ``targets[offsets[i]:offsets[i + 1]]``."""
+    objids = np.array([c.objid for c in cropobjects], dtype='int64')
+    offsets = np.zeros(len(cropobjects) + 1, dtype='int64')
+    np.cumsum([len(c.outlinks) for c in cropobjects], out=offsets[1:])
+    targets = np.fromiter(itertools.chain.from_iterable(c.outlinks for c in cropobjects),
+                          dtype='int64', count=offsets[-1])
+    return objids, offsets, targets
+
+
+@njit(cache=True)
+def count_edge_matches(matching_indices,
+                       p_objids, p_offsets, p_targets,
+                       r_objids, r_offsets, r_targets,
+                       p_objid_bound, r_objid_bound):
+    """Counts the true positive, false positive and false negative edges
+    of the matched objects. The graphs are given as ``outlinks_to_arrays()``
+    outputs; the objid bounds are one more than the highest objid that
+    appears in the respective graph."""
+    # Relative ids, -1 where the object has no match (the matching
+    # is one-to-one, so every object is matched at most once)
+    prediction_to_reference_mapping = np.full(p_objid_bound, -1, dtype=np.int64)
+    reference_to_prediction_mapping = np.full(r_objid_bound, -1, dtype=np.int64)
+    for k in range(matching_indices.shape[0]):
+        p_objid = p_objids[matching_indices[k, 0]]
+        r_objid = r_objids[matching_indices[k, 1]]
+        prediction_to_reference_mapping[p_objid] = r_objid
+        reference_to_prediction_mapping[r_objid] = p_objid
+
+    true_positives, false_positives, false_negatives = 0, 0, 0
+    for k in range(matching_indices.shape[0]):
+        p, r = matching_indices[k, 0], matching_indices[k, 1]
 
-    return pairs
+        # Check TP and FP (from predicted to reference)
+        for i in range(p_offsets[p], p_offsets[p + 1]):
+            mapped_edge = prediction_to_reference_mapping[p_targets[i]]
+            if mapped_edge < 0:
+                # We predicted an edge between objects, but the objects from the prediction
+                # could not be matched to objects from the ground truth, therefore this
+                # edge does not exists there as should be counted as false positive.
+                false_positives += 1
+                continue
+            is_in_reference = False
+            for j in range(r_offsets[r], r_offsets[r + 1]):
+                if r_targets[j] == mapped_edge:
+                    is_in_reference = True
+                    break
+            if is_in_reference:
+                true_positives += 1
+            else:
+                false_positives += 1
 
+        # Check FN (from reference to predicted)
+        for j in range(r_offsets[r], r_offsets[r + 1]):
+            mapped_edge = reference_to_prediction_mapping[r_targets[j]]
+            if mapped_edge < 0:
+                # An outgoing edge from the reference object does not even have a corresponding object
+                # in the prediction, therefore it is a false negative.
+                false_negatives += 1
+                continue
+            is_in_prediction = False
+            for i in range(p_offsets[p], p_offsets[p + 1]):
+                if p_targets[i] == mapped_edge:
+                    is_in_prediction = True
+                    break
+            if not is_in_prediction:
+                # An outgoing edge from the reference object does have a corresponding object
+                # in the prediction, but no edge, therefore it is a false negative.
+                false_negatives += 1
 
-def cropobject_dict_from_list(cropobject_list):
-    return {cropobject.objid: cropobject for cropobject in cropobject_list}
+    return true_positives, false_positives, false_negatives
 
 
 def evaluate_result(mung_reference_file, predicted_mung_file):
@@ -111,52 +207,28 @@ def sanitize_crop_object_class_names(crop_objects: List[CropObject]):
 
 
 def compute_statistics_on_crop_objects(reference_objects, predicted_objects):
-    reference_objects = [copy.deepcopy(c) for c in reference_objects]
-    predicted_objects = [copy.deepcopy(c) for c in predicted_objects]
+    # Sanitizing only re-assigns the class names, so shallow copies
+    # are enough to keep the caller's objects untouched.
+    reference_objects = [copy.copy(c) for c in reference_objects]
+    predicted_objects = [copy.copy(c) for c in predicted_objects]
     sanitize_crop_object_class_names(reference_objects)
     sanitize_crop_object_class_names(predicted_objects)
 
     # Build pairs between predicted and reference
-    object_matching_pair = get_object_matching_pairs(predicted_objects, reference_objects)
-
-    # Relative ids
-    reference_to_prediction_mapping = {r: p for p, r in object_matching_pair}
-    prediction_to_reference_mapping = {p: r for p, r in object_matching_pair}
-
-    # Build dict's from crop object lists that are accessed by id
-    predicted_objects = cropobject_dict_from_list(predicted_objects)
-    reference_objects = cropobject_dict_from_list(reference_objects)
+    matching_indices = get_object_matching_indices(predicted_objects, reference_objects)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        for p, r in matching_indices:
+            logging.debug('Match %d %d', predicted_objects[p].objid, reference_objects[r].objid)
 
     # Basic evaluation metrics
-    true_positives, false_positives, false_negatives = [0, 0, 0]
-
-    for p_obj_id, r_obj_id in object_matching_pair:
-        predicted_object = predicted_objects[p_obj_id]
-        reference_object = reference_objects[r_obj_id]
-
-        # Check TP and FP (from predicted to reference)
-        for out_p_edge in predicted_object.outlinks:
-            if out_p_edge not in prediction_to_reference_mapping:
-                # We predicted an edge between objects, but the objects from the prediction
-                # could not be matched to objects from the ground truth, therefore this
-                # edge does not exists there as should be counted as false positive.
-                false_positives += 1
-            elif prediction_to_reference_mapping[out_p_edge] in reference_object.outlinks:
-                true_positives += 1
-                logging.debug(" ".join(map(str, [p_obj_id, r_obj_id, out_p_edge])))
-            else:
-                false_positives += 1
-
-        # Check FN (from reference to predicted)
-        for out_r_edge in reference_object.outlinks:
-            if out_r_edge not in reference_to_prediction_mapping:
-                # An outgoing edge from the reference object does not even have a corresponding object
-                # in the prediction, therefore it is a false negative.
-                false_negatives += 1
-            elif reference_to_prediction_mapping[out_r_edge] not in predicted_object.outlinks:
-                # An outgoing edge from the reference object does have a corresponding object
-                # in the prediction, but no edge, therefore it is a false negative.
-                false_negatives += 1
+    p_objids, p_offsets, p_targets = outlinks_to_arrays(predicted_objects)
+    r_objids, r_offsets, r_targets = outlinks_to_arrays(reference_objects)
+    p_objid_bound = max(p_objids.max(initial=-1), p_targets.max(initial=-1)) + 1
+    r_objid_bound = max(r_objids.max(initial=-1), r_targets.max(initial=-1)) + 1
+    true_positives, false_positives, false_negatives = count_edge_matches(matching_indices,
+                                                                          p_objids, p_offsets, p_targets,
+                                                                          r_objids, r_offsets, r_targets,
+                                                                          p_objid_bound, r_objid_bound)
 
     precision = true_positives / (true_positives + false_positives)
     recall = true_positives / (true_positives + false_negatives)
@@ -169,6 +241,10 @@ if __name__ == '__main__':
     parser = build_argument_parser()
     args = parser.parse_args()
 
+    if args.verbose or args.debug:
+        logging.basicConfig(format='%(levelname)s: %(message)s',
+                            level=logging.DEBUG if args.debug else logging.INFO)
+
     reference_mungs = []
     if os.path.isfile(args.reference):
         reference_mungs.append(args.reference)
@@ -1,13 +1,13 @@
 #!/usr/bin/env python
 """This is a file that implements various evaluation functionality
 for the MungLinker experiments."""
-from __future__ import print_function, unicode_literals
 import argparse
 import logging
 import time
 
 import numpy as np
 
+from munglinker.mung_utils import encode_class_names
 from munglinker.utils import dice
 
 __version__ = "0.0.1"
@@ -51,23 +51,43 @@ def evaluate_classification_by_class_pairs(mungos_from, mungos_to, true_classes,
     :param min_support: In order to be included in the output, a class pair
         has to have a support of at least this many examples.
     """
-    class_pair_index = {}
-    for i, (m_fr, m_to, tc, pc) in enumerate(zip(mungos_from, mungos_to,
-                                                 true_classes, pred_classes)):
-        cpair = m_fr.clsname, m_to.clsname
-        if cpair not in class_pair_index:
-            class_pair_index[cpair] = []
-        class_pair_index[cpair].append(i)
+    true_classes = np.asarray(true_classes)
+    pred_classes = np.asarray(pred_classes)
 
     class_pair_results = dict()
-    for cpair in class_pair_index:
-        cpi = np.array(class_pair_index[cpair]).astype('int64')
-        cp_true = np.array([true_classes[i] for i in cpi])
-        cp_pred = np.array([pred_classes[i] for i in cpi])
-        cp_results_all = evaluate_clf(cp_pred, cp_true)
+    if len(true_classes) == 0:
+        return class_pair_results
+
+    # Group the examples by class pair with NumPy: each class pair
+    # is encoded as a single integer key
+    clsname_to_id, (from_ids, to_ids) = encode_class_names([m.clsname for m in mungos_from],
+                                                           [m.clsname for m in mungos_to])
+    id_to_clsname = list(clsname_to_id.keys())
+    class_pair_keys = (from_ids.astype('int32') << 16) | to_ids.astype('int32')
+
+    unique_keys, first_index, class_pair_inverse = np.unique(class_pair_keys, return_index=True,
+                                                             return_inverse=True)
+    class_pair_inverse = class_pair_inverse.reshape(-1)
+
+    # Lay out the example indices of each class pair contiguously in one
+    # int32 array (stable, so each bucket keeps the original example order),
+    # with bucket_start[k]:bucket_start[k + 1] delimiting the k-th pair.
+    bucket = np.ascontiguousarray(np.argsort(class_pair_inverse, kind='stable'), dtype='int32')
+    bucket_start = np.zeros(len(unique_keys) + 1, dtype='int64')
+    np.cumsum(np.bincount(class_pair_inverse, minlength=len(unique_keys)), out=bucket_start[1:])
+
+    # Go through the class pairs in the order in which they first occur
+    for class_pair_index in np.argsort(first_index):
+        key = unique_keys[class_pair_index]
+        cpair = id_to_clsname[key >> 16], id_to_clsname[key & 0xFFFF]
+        selection = bucket[bucket_start[class_pair_index]:bucket_start[class_pair_index + 1]]
+        support = len(selection)
+        if support < min_support:
+            continue
+        cp_results_all = evaluate_clf(pred_classes[selection], true_classes[selection])
         # print('cpair {}: support {}'.format(cpair, cp_results_all['support']))
         if cp_results_all['support'] is None:
-            cp_results_all['support'] = len(cpi)
+            cp_results_all['support'] = support
         elif isinstance(cp_results_all['support'], list):
             cp_results_all['support'] = cp_results_all['support'].sum()
         if cp_results_all['support'] < min_support:
@@ -129,12 +149,12 @@ def build_argument_parser():
 
 def main(args):
     logging.info('Starting main...')
-    _start_time = time.time()
+    _start_time = time.perf_counter()
 
     # Your code goes here
     raise NotImplementedError()
 
-    _end_time = time.time()
+    _end_time = time.perf_counter()
     logging.info('[XXXX] done in {0:.3f} s'.format(_end_time - _start_time))
 
 
@@ -1,6 +1,5 @@
 """This file defines the pytorch fit() wrapper.
 """
-from __future__ import print_function, unicode_literals, division
 
 import torch
 from torch.nn.modules.loss import _WeightedLoss
@@ -1,11 +1,10 @@
 import collections
-import copy
 import logging
 import os
 import pprint
 from math import ceil
 from statistics import mean
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 import numpy
 import numpy.random
@@ -14,7 +13,6 @@ from PIL import Image, ImageOps
 from muscima.cropobject import CropObject
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 from tensorboardX import SummaryWriter
-from torch.autograd import Variable
 from torch.nn import Module
 from tqdm import tqdm
 
@@ -22,6 +20,7 @@ from munglinker.batch_iterators import PoolIterator
 from munglinker.data_pool import PairwiseMungoDataPool
 from munglinker.evaluation import evaluate_classification_by_class_pairs, print_class_pair_results
 from munglinker.training_strategies import PyTorchTrainingStrategy
+from munglinker.mung_utils import clone_cropobject, cropobjects_by_objid
 from munglinker.utils import targets2classes
 
 torch.set_default_tensor_type('torch.FloatTensor')
@@ -51,9 +50,13 @@ class PyTorchNetwork(object):
         """
         self.net = net
         self.cuda = torch.cuda.is_available()
+        self.device = torch.device('cuda' if self.cuda else 'cpu')
 
-        if self.cuda:
-            self.net.cuda()
+        self.net.to(self.device)
+        # Pinned host and device buffers for copying the batches to the GPU:
+        # one set per array rank, reused as long as the shape stays the same
+        # (see __np2torch())
+        self.__staging_buffers = {}
 
         if training_strategy is None:
             self.training_strategy = PyTorchTrainingStrategy()
@@ -297,13 +300,10 @@ class PyTorchNetwork(object):
             np_targets = data_batch["targets"]  # type: numpy.ndarray
 
             # This assumes that the generator does not already
-            # return Torch Variables, which the model can however
+            # return Torch tensors, which the model can however
             # specify in its prepare() function(s).
-            inputs = Variable(torch.from_numpy(np_inputs).float())
-            targets = Variable(torch.from_numpy(np_targets).float())
-            if self.cuda:
-                inputs = inputs.cuda()
-                targets = targets.cuda()
+            inputs = self.__np2torch(np_inputs)
+            targets = self.__np2torch(np_targets)
 
             # One training update:
             optimizer.zero_grad()
@@ -387,12 +387,13 @@ class PyTorchNetwork(object):
             # One mung is one file
             reference_crop_objects = mung.cropobjects  # type: List[CropObject]
             doc = reference_crop_objects[0].doc
-            inference_crop_objects = [copy.deepcopy(m) for m in mung.cropobjects]
+            # Only the edges of the copies are re-done, so the clones can share everything else
+            inference_crop_objects = [clone_cropobject(m) for m in mung.cropobjects]
             for m in inference_crop_objects:
-                m.outlinks = []
-                m.inlinks = []
+                m.outlinks = set()
+                m.inlinks = set()
 
-            id_to_crop_object_mapping = {c.objid: c for c in inference_crop_objects}
+            id_to_crop_object_mapping = cropobjects_by_objid(inference_crop_objects)
             indices = [i for i, m in enumerate(validation_mungos_from) if m.doc == doc]
             mungos_from_this_file = [validation_mungos_from[i] for i in indices]
             mungos_to_this_file = [validation_mungos_to[i] for i in indices]
@@ -401,7 +402,8 @@ class PyTorchNetwork(object):
             for mungo_from, mungo_to, output_class in zip(mungos_from_this_file, mungos_to_this_file, output_classes):
                 has_edge = output_class == 1
                 if has_edge:
-                    MunglinkerRunner.add_edge_in_graph(mungo_from.objid, mungo_to.objid, id_to_crop_object_mapping)
+                    MunglinkerRunner.add_edge_in_graph(id_to_crop_object_mapping[mungo_from.objid],
+                                                       id_to_crop_object_mapping[mungo_to.objid])
 
             from munglinker.evaluate_notation_assembly_from_mung import compute_statistics_on_crop_objects
             precision, recall, f1_score, true_positives, false_positives, false_negatives = \
@@ -441,8 +443,8 @@ class PyTorchNetwork(object):
         class_pair_results['all'] = validation_results
         return class_pair_results
 
-    def predict(self, data_pool: PairwiseMungoDataPool, runtime_batch_iterator, export_patches=False) -> Tuple[
-        List[CropObject], List[CropObject], List[int]]:
+    def predict(self, data_pool: PairwiseMungoDataPool, runtime_batch_iterator, export_patches=False) -> Iterator[
+        Tuple[List[CropObject], List[CropObject], numpy.ndarray]]:
         """Runs the model prediction. Expects a data pool and a runtime
         batch iterator.
 
@@ -455,19 +457,17 @@ class PyTorchNetwork(object):
 
         :param runtime_batch_iterator: Batch iterator from a model's runtime.
 
-        :returns: A list of from-crop-objects, a list of to-crop-objects (they form a pair),
-            a list of predictions (1 = there is an edge, 0 = there is no edge) and a list of input arrays, that
-            were used for classification. All list have the same size.
+        :returns: A generator that yields one ``(mungos_from, mungos_to, predicted_classes)``
+            tuple per batch: a list of from-crop-objects, a list of to-crop-objects (they form a pair)
+            and an array of predictions (1 = there is an edge, 0 = there is no edge). All three have
+            the same size. Consuming the predictions batch by batch means that they never have
+            to be held in memory for the whole data pool at once.
         """
         iterator = runtime_batch_iterator(data_pool)
         number_of_batches = ceil(len(data_pool) / runtime_batch_iterator.batch_size)
         print('{} runtime entities found. Processing them in {} batches.'.format(len(data_pool), number_of_batches),
               flush=True)
 
-        all_mungos_from = []
-        all_mungos_to = []
-        all_np_predicted_classes = []
-
         os.makedirs("pil_exports", exist_ok=True)
 
         for current_batch_index, data_batch in enumerate(tqdm(iterator, total=number_of_batches,
@@ -476,14 +476,16 @@ class PyTorchNetwork(object):
             mungos_to = data_batch["mungos_to"]  # type: List[CropObject]
             np_inputs = data_batch["patches"]  # type: numpy.ndarray
 
-            all_mungos_from.extend(mungos_from)
-            all_mungos_to.extend(mungos_to)
-
             inputs = self.__np2torch(np_inputs)
-            predictions = self.net(inputs).flatten()
-            np_predictions = self.__torch2np(predictions)
+            # No autograd bookkeeping is needed at runtime. (The context is only
+            # around the forward pass, not around the yield to the caller.)
+            # On the GPU, the forward pass runs in half precision; the outputs
+            # are thresholded in full precision.
+            with torch.inference_mode(), torch.autocast(device_type=self.device.type, dtype=torch.float16,
+                                                        enabled=self.cuda):
+                predictions = self.net(inputs).flatten()
+            np_predictions = self.__torch2np(predictions.float())
             np_predicted_classes = targets2classes(np_predictions)
-            all_np_predicted_classes.extend(np_predicted_classes)
 
             if export_patches:
                 for index in range(self.training_strategy.batch_size):
@@ -493,9 +495,9 @@ class PyTorchNetwork(object):
                         "pil_exports/{0}-{1}-to-{2}.png".format(mungos_from[index].doc, mungos_from[index].objid,
                                                                 mungos_to[index].objid))
 
-        assert len(all_mungos_from) == len(all_mungos_to)
-        assert len(all_mungos_from) == len(all_np_predicted_classes)
-        return all_mungos_from, all_mungos_to, all_np_predicted_classes
+            assert len(mungos_from) == len(mungos_to)
+            assert len(mungos_from) == len(np_predicted_classes)
+            yield mungos_from, mungos_to, np_predicted_classes
 
     @staticmethod
     def convert_patch_to_pil_image(patch):
@@ -572,7 +574,7 @@ class PyTorchNetwork(object):
         return agg_results_per_label, agg_overall
 
     def __torch2np(self, var):
-        """Converts the PyTorch Variable or tensor to numpy."""
+        """Converts the PyTorch tensor to numpy."""
         if self.cuda:
             output = var.data.cpu().numpy()
         else:
@@ -581,10 +583,32 @@ class PyTorchNetwork(object):
         return output
 
     def __np2torch(self, ndarray):
-        output = Variable(torch.from_numpy(ndarray).float())
-        if self.cuda:
-            output = output.cuda()
-        return output
+        """Converts the numpy array to a float PyTorch tensor on the network's
+        device. On the GPU, the returned tensor is a buffer that gets reused
+        by the next conversion of an array with the same rank."""
+        if not self.cuda:
+            return torch.from_numpy(ndarray).float()
+
+        # Batches and targets have different ranks, so they keep their own
+        # buffers; a new shape (e.g. a small pool) replaces the old buffers.
+        staging_buffers = self.__staging_buffers.get(ndarray.ndim)
+        if staging_buffers is None or staging_buffers[0].shape != ndarray.shape:
+            if staging_buffers is not None:
+                staging_buffers[2].synchronize()
+            staging_buffers = (torch.empty(ndarray.shape, dtype=torch.float32, pin_memory=True),
+                               torch.empty(ndarray.shape, dtype=torch.float32, device=self.device),
+                               torch.cuda.Event())
+            self.__staging_buffers[ndarray.ndim] = staging_buffers
+        host_buffer, device_buffer, copy_done = staging_buffers
+
+        # Going through pinned memory makes the host-to-device copy
+        # asynchronous, so it can overlap with the computation. The host
+        # buffer must not be overwritten before its previous copy is done.
+        copy_done.synchronize()
+        host_buffer.numpy()[...] = ndarray
+        device_buffer.copy_(host_buffer, non_blocking=True)
+        copy_done.record()
+        return device_buffer
 
     def __log_epoch_to_tensorboard(self, epoch_index,
                                    training_epoch_outputs,
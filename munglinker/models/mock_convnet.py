@@ -1,5 +1,6 @@
 import logging
-from typing import List
+from math import ceil
+from typing import Iterator, List, Tuple
 
 import numpy as np
 from muscima.cropobject import CropObject
@@ -31,35 +32,27 @@ class MockNetwork(MungLinkerNetwork):
     def forward(self, *input):
         pass
 
-    def predict(self, data_pool, runtime_batch_iterator):
+    def predict(self, data_pool, runtime_batch_iterator) -> Iterator[
+        Tuple[List[CropObject], List[CropObject], np.ndarray]]:
+        """Mimics ``PyTorchNetwork.predict()``: yields one
+        ``(mungos_from, mungos_to, predicted_classes)`` tuple per batch,
+        with random predicted classes."""
         # Initialize data feeding from iterator
         iterator = runtime_batch_iterator(data_pool)
-        generator = (x for x in iterator)  # No threaded generator
 
-        n_batches = len(data_pool) // runtime_batch_iterator.batch_size
+        n_batches = ceil(len(data_pool) / runtime_batch_iterator.batch_size)
         logging.info('n. of runtime entities: {}; batches: {}'
                      ''.format(len(data_pool), n_batches))
 
-        # Aggregate results
-        all_mungo_pairs = []
-        all_np_preds = np.array([])
+        from munglinker.utils import targets2classes
 
         # Run generator
-        for batch_idx, _data_point in enumerate(generator):
-            mungo_pairs, np_inputs = _data_point  # next(generator)
-            mungo_pairs = list(mungo_pairs)
-            all_mungo_pairs.extend(list(mungo_pairs))
+        for data_batch in iterator:
+            mungos_from = data_batch["mungos_from"]
+            mungos_to = data_batch["mungos_to"]
 
-            np_pred = np.random.randint(0, 2, len(mungo_pairs))
+            np_pred = np.random.randint(0, 2, len(mungos_from))
             # inputs = self._np2torch(np_inputs)
             # pred = self.net(inputs)
             # np_pred = self._torch2np(pred)
-            all_np_preds = np.concatenate((all_np_preds, np_pred))
-
-        logging.info('All np preds: {} positive ({})'
-                     ''.format(all_np_preds.sum(), all_np_preds.mean()))
-
-        from munglinker.utils import targets2classes
-
-        all_np_pred_classes = targets2classes(all_np_preds)
-        return all_mungo_pairs, all_np_pred_classes
+            yield mungos_from, mungos_to, targets2classes(np_pred)
@@ -1,6 +1,6 @@
 from torch import nn as nn
 
-from munglinker.batch_iterators import PoolIterator
+from munglinker.batch_iterators import PoolIterator, DataLoaderPoolIterator
 
 
 class MungLinkerNetwork(nn.Module):
@@ -19,7 +19,11 @@ class MungLinkerNetwork(nn.Module):
     def test_batch_iterator(self):
         return PoolIterator(batch_size=self.batch_size, transform=None, shuffle=False)
 
-    def runtime_batch_iterator(self):
-        """ Compile batch iterator for runtime: discards the outputs """
+    def runtime_batch_iterator(self, num_workers=0):
+        """ Compile batch iterator for runtime: discards the outputs.
+        With ``num_workers > 0``, the batches are extracted in that many
+        background worker processes. """
         # Change k_samples to a fixed number to log every k_samples batches. Effectively logs more often.
+        if num_workers > 0:
+            return DataLoaderPoolIterator(batch_size=self.batch_size, transform=None, num_workers=num_workers)
         return PoolIterator(batch_size=self.batch_size, transform=None, shuffle=False)
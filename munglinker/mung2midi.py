@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 """This is a script that builds the MIDI file out of a notation
 graph, given that the graph is sufficient for building the MIDI."""
-from __future__ import print_function, unicode_literals
 import argparse
 import logging
 import os
@@ -135,7 +134,7 @@ def build_argument_parser():
 
 def main(args):
     logging.info('Starting main...')
-    _start_time = time.time()
+    _start_time = time.perf_counter()
 
     cropobjects = parse_cropobject_list(args.input_mung)
     graph = NotationGraph(cropobjects)
@@ -196,7 +195,7 @@ def main(args):
         with open(output_path, 'wb') as stream_out:
             mf.writeFile(stream_out)
 
-    _end_time = time.time()
+    _end_time = time.perf_counter()
     logging.info('mung2midi.py done in {0:.3f} s'.format(_end_time - _start_time))
 
 
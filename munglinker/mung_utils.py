@@ -0,0 +1,87 @@
+"""Small NumPy helpers for working with MuNGs (lists of ``CropObject``s).
+They do not depend on torch, so that e.g. the evaluation script can use
+them without importing it."""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from muscima.cropobject import CropObject
+
+
+def cropobjects_to_soa(cropobjects: List[CropObject]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Collects the bounding boxes, class names and objids of the given
+    MuNGOs into parallel arrays (structure-of-arrays), so that computations
+    over all the objects can be vectorized.
+
+    :returns: An ``(N, 4)`` int32 array of ``top, left, bottom, right``
+        bounding boxes, an object array of class names, and an int32
+        array of objids.
+    """
+    boxes = np.empty((len(cropobjects), 4), dtype='int32')
+    clsnames = np.empty(len(cropobjects), dtype=object)
+    objids = np.empty(len(cropobjects), dtype='int32')
+    for i, c in enumerate(cropobjects):
+        boxes[i] = c.bounding_box
+        clsnames[i] = c.clsname
+        objids[i] = c.objid
+    return boxes, clsnames, objids
+
+
+def clone_cropobject(cropobject: CropObject, copy_mask: bool = False) -> CropObject:
+    """Copies the MuNGO directly through its attributes (much cheaper
+    than ``copy.copy()``/``copy.deepcopy()``). The clone has no edges:
+    it gets new, empty ``inlinks`` and ``outlinks``. It shares the mask
+    with the original, unless ``copy_mask`` is set."""
+    clone = CropObject.__new__(CropObject)
+    clone.__dict__.update(cropobject.__dict__)
+    clone.inlinks = []
+    clone.outlinks = []
+    if copy_mask and cropobject.mask is not None:
+        clone.mask = cropobject.mask.copy()
+    return clone
+
+
+def cropobjects_by_objid(cropobjects: List[CropObject]) -> List[Optional[CropObject]]:
+    """Returns a list that maps objids to the given MuNGOs, i.e.
+    ``cropobjects_by_objid(cropobjects)[c.objid] is c``; the entries
+    of objids that are not used are ``None``. Objids are small
+    non-negative integers, so this is cheaper than a dict lookup."""
+    id_to_cropobject = [None] * (max((c.objid for c in cropobjects), default=-1) + 1)
+    for c in cropobjects:
+        id_to_cropobject[c.objid] = c
+    return id_to_cropobject
+
+
+def edges_to_links(edges: np.ndarray) -> Tuple[Dict[int, List[int]], Dict[int, List[int]]]:
+    """Groups an ``(E, 2)`` array of unique ``(from objid, to objid)`` edges
+    into the outlinks and inlinks of each objid.
+
+    :returns: The ``{objid: outlinks}`` and ``{objid: inlinks}`` dicts,
+        with sorted lists of objids. Objids that have no outlinks (inlinks)
+        are not in the respective dict.
+    """
+    return __group_edges(edges[:, 0], edges[:, 1]), __group_edges(edges[:, 1], edges[:, 0])
+
+
+def __group_edges(keys: np.ndarray, values: np.ndarray) -> Dict[int, List[int]]:
+    if len(keys) == 0:
+        return {}
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    group_starts = np.flatnonzero(np.diff(keys)) + 1
+    return dict(zip(keys[np.concatenate([[0], group_starts])].tolist(),
+                    [group.tolist() for group in np.split(values, group_starts)]))
+
+
+def encode_class_names(*clsname_sequences) -> Tuple[Dict[str, int], List[np.ndarray]]:
+    """Interns class names as small integer ids, shared across all
+    the given sequences of class names, so that they can be compared
+    and grouped as plain integers.
+
+    :returns: The ``{clsname: id}`` dict and, for each of the given
+        sequences, an ``int16`` array of the ids of its class names.
+    """
+    clsname_to_id = {}
+    class_ids = [np.array([clsname_to_id.setdefault(clsname, len(clsname_to_id)) for clsname in clsnames],
+                          dtype='int16')
+                 for clsnames in clsname_sequences]
+    return clsname_to_id, class_ids
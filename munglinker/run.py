@@ -2,30 +2,48 @@
 or a directory of input images, and outputs the corresponding MIDI file(s).
 """
 import argparse
-import copy
+import itertools
 import logging
 import os
 import time
 from glob import glob
-from typing import Dict
+from typing import BinaryIO, List
 
 import torch
-from PIL import Image
 from muscima.cropobject import CropObject
 from muscima.graph import NotationGraph, NotationGraphError
-from muscima.io import parse_cropobject_list, export_cropobject_list
+from muscima.io import parse_cropobject_list
 
 from munglinker.batch_iterators import PoolIterator
-from munglinker.data_pool import PairwiseMungoDataPool, load_config
+from munglinker.data_pool import PairwiseMungoDataPool, load_config, load_image
 from munglinker.evaluate_notation_assembly_from_mung import evaluate_result
 from munglinker.model import PyTorchNetwork
 from munglinker.mung2midi import build_midi
+from munglinker.mung_utils import clone_cropobject, edges_to_links
 from munglinker.utils import midi_matrix_to_midi
 from munglinker.utils import select_model, config2data_pool_dict, MockNetwork
-import pandas as pd
 import numpy as np
 
 
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+
+def write_cropobject_list(cropobjects: List[CropObject], output_file: BinaryIO):
+    """Writes the same XML as ``muscima.io.export_cropobject_list()`` into
+    the given binary file, one MuNGO at a time, so that the whole document
+    never has to be built as a single string."""
+    output_file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                      '<CropObjectList'
+                      ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                      ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">\n'
+                      '<CropObjects>\n'.encode('utf-8'))
+    for i, cropobject in enumerate(cropobjects):
+        if i > 0:
+            output_file.write(b'\n')
+        output_file.write(str(cropobject).encode('utf-8'))
+    output_file.write('\n</CropObjects>\n</CropObjectList>'.encode('utf-8'))
+
+
 class MunglinkerRunner(object):
     """The MunglinkerRunner defines the Munglinker component interface. It has a run()
     method that takes a MuNG (the whole graph) and outputs a new MuNG with the same
@@ -67,7 +85,7 @@ class MunglinkerRunner(object):
         self.data_pool_dict = data_pool_dict
 
     def run(self, image_file, mung: NotationGraph) -> NotationGraph:
-        image = np.array(Image.open(image_file).convert('1')).astype('uint8')
+        image = load_image(image_file)
 
         # This is for training on bounding boxes,
         # which needs to be done in order to then process
@@ -78,55 +96,71 @@ class MunglinkerRunner(object):
                 image_mask = image[t:b, l:r]
                 mungo.set_mask(image_mask)
 
+        # The patches are float32 (as the network takes them), so the image
+        # is converted once here, instead of in every patch that is cut out of it.
+        image = np.ascontiguousarray(image, dtype='float32')
         data_pool = PairwiseMungoDataPool(mungs=[mung], images=[image], **self.data_pool_dict)
-        mungos_from, mungos_to, output_classes = self.model.predict(data_pool, self.runtime_batch_iterator)
 
         # Since the runner only takes one image & MuNG at a time,
         # we have the luxury that all the mung pairs belong to the same
-        # document, and we can just re-do the edges.
-        mungo_copies = [copy.deepcopy(m) for m in mung.cropobjects]
+        # document, and we can just re-do the edges. All the edges are
+        # re-done from scratch, so there is no need for the add_edge_in_graph()
+        # checks: the predicted edges are just collected as arrays of
+        # (from objid, to objid), batch by batch, as they come from the model.
+        edges_from, edges_to = [np.zeros(0, dtype='int32')], [np.zeros(0, dtype='int32')]
+        for mungos_from, mungos_to, output_classes in self.model.predict(data_pool, self.runtime_batch_iterator):
+            has_edge = output_classes == 1
+            edges_from.append(np.fromiter((m.objid for m in itertools.compress(mungos_from, has_edge)), dtype='int32'))
+            edges_to.append(np.fromiter((m.objid for m in itertools.compress(mungos_to, has_edge)), dtype='int32'))
+
+        # Sorted by from-objid, then to-objid; this also drops the pairs that were
+        # predicted twice (the last batch is padded with pairs from the first one).
+        edges = np.unique(np.stack([np.concatenate(edges_from), np.concatenate(edges_to)], axis=1), axis=0)
+        outlinks, inlinks = edges_to_links(edges)
+
+        # Only the edges of the copies differ from the input MuNG, so
+        # the clones can share everything else (e.g. the masks).
+        mungo_copies = [clone_cropobject(m) for m in mung.cropobjects]
         for m in mungo_copies:
-            m.outlinks = []
-            m.inlinks = []
+            m.outlinks = outlinks.get(m.objid, [])
+            m.inlinks = inlinks.get(m.objid, [])
 
         notation_graph = NotationGraph(mungo_copies)
-        id_to_crop_object_mapping = {c.objid: c for c in notation_graph.cropobjects}
-        for mungo_from, mungo_to, output_class in zip(mungos_from, mungos_to, output_classes):
-            has_edge = output_class == 1
-            if has_edge:
-                self.add_edge_in_graph(mungo_from.objid, mungo_to.objid, id_to_crop_object_mapping)
-
         return notation_graph
 
     @staticmethod
-    def add_edge_in_graph(from_node: CropObject, to_node: CropObject,
-                          id_to_crop_object_mapping: Dict[int, CropObject]):
-        """Add an edge between the MuNGOs with objids ``fr --> to``.
-            If the edge is already in the graph, warns and does nothing."""
-        if from_node not in id_to_crop_object_mapping:
-            raise NotationGraphError('Cannot remove edge from node_id {0}: not in graph!'.format(from_node))
-        if to_node not in id_to_crop_object_mapping:
-            raise NotationGraphError('Cannot remove edge to node_id {0}: not in graph!'.format(to_node))
-
-        if to_node in id_to_crop_object_mapping[from_node].outlinks:
-            if from_node in id_to_crop_object_mapping[to_node].inlinks:
-                logging.info('Adding edge that is alredy in the graph: {} --> {}'
-                             ' -- doing nothing'.format(from_node, to_node))
+    def add_edge_in_graph(from_node: CropObject, to_node: CropObject):
+        """Add an edge ``from_node --> to_node`` between the two MuNGOs.
+            If the edge is already in the graph, warns and does nothing.
+            Expects the ``outlinks`` and ``inlinks`` of the MuNGOs to be sets."""
+        if to_node.objid in from_node.outlinks:
+            if from_node.objid in to_node.inlinks:
+                logging.info('Adding edge that is alredy in the graph: %s --> %s'
+                             ' -- doing nothing', from_node.objid, to_node.objid)
                 return
             else:
                 raise NotationGraphError('Found {0} in outlinks of {1}, but not {1} in inlinks of {0}!'
-                                         ''.format(to_node, from_node))
-        elif from_node in id_to_crop_object_mapping[to_node].inlinks:
+                                         ''.format(to_node.objid, from_node.objid))
+        elif from_node.objid in to_node.inlinks:
             raise NotationGraphError('Found {0} in inlinks of {1}, but not {1} in outlinks of {0}!'
-                                     ''.format(from_node, to_node))
+                                     ''.format(from_node.objid, to_node.objid))
 
-        id_to_crop_object_mapping[from_node].outlinks.append(to_node)
-        id_to_crop_object_mapping[to_node].inlinks.append(from_node)
+        from_node.outlinks.add(to_node.objid)
+        to_node.inlinks.add(from_node.objid)
 
     def model_output_to_midi(self, output_repr):
         return midi_matrix_to_midi(output_repr)
 
 
+def compile_network(network: torch.nn.Module, example_inputs: torch.Tensor) -> torch.nn.Module:
+    """Compiles the network for faster inference: with ``torch.compile``
+    where it is available, otherwise with ``torch.jit.trace`` on the given
+    example inputs (which need to have the runtime batch shape)."""
+    if hasattr(torch, 'compile'):
+        return torch.compile(network, mode='reduce-overhead')
+    return torch.jit.trace(network, example_inputs)
+
+
 def build_argument_parser():
     parser = argparse.ArgumentParser(description=__doc__, add_help=True,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -162,9 +196,16 @@ def build_argument_parser():
                         help='The directory that will contain the MuNGs.')
     parser.add_argument('--batch_size', type=int, action='store', default=10,
                         help='The runtime iterator batch size.')
+    parser.add_argument('--num_workers', type=int, action='store', default=0,
+                        help='The number of background processes that extract'
+                             ' the runtime batches. With 0 (the default),'
+                             ' the batches are extracted in the main process.')
     parser.add_argument('--mock', action='store_true',
                         help='If set, will not load a real model and just run'
                              ' a mock prediction using MockNetwork.predict()')
+    parser.add_argument('--compile', action='store_true',
+                        help='If set, will compile the loaded model before'
+                             ' running it (see compile_network()).')
     parser.add_argument('--play', action='store_true',
                         help='If set, will run MIDI inference over the output'
                              ' MuNG and play the result.')
@@ -182,7 +223,7 @@ if __name__ == '__main__':
         logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
     logging.info('Starting main...')
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     logging.info('Loading config: {}'.format(args.config))
     config = load_config(args.config)
@@ -232,7 +273,7 @@ if __name__ == '__main__':
 
     logging.info('Loading model: {}'.format(args.model))
     mung_linker_network = select_model(args.model, args.batch_size)
-    runtime_batch_iterator = mung_linker_network.runtime_batch_iterator()
+    runtime_batch_iterator = mung_linker_network.runtime_batch_iterator(num_workers=args.num_workers)
 
     if args.mock:
         logging.info('Using mock network, so no parameters will be loaded.')
@@ -241,7 +282,14 @@ if __name__ == '__main__':
         print('Loading model from: {0}'.format(args.params))
         checkpoint = torch.load(args.params)
         mung_linker_network.load_state_dict(checkpoint['model_state_dict'])
+        mung_linker_network.eval()
+        # The patches all have the same shape, so cuDNN can pick the fastest algorithms once
+        torch.backends.cudnn.benchmark = True
         model = PyTorchNetwork(net=mung_linker_network)
+        if args.compile:
+            patch_height, patch_width = config2data_pool_dict(config)['patch_size']
+            example_inputs = torch.zeros((args.batch_size, 3, patch_height, patch_width), device=model.device)
+            model.net = compile_network(model.net, example_inputs)
         print("Loaded model which has trained {0} epochs and achieved validation loss of {1:.3f}"
               "".format(checkpoint["epoch"], checkpoint["best_validation_loss"]))
 
@@ -256,8 +304,8 @@ if __name__ == '__main__':
 
         print('Running Munglinker: {} / {}'.format(i, len(image_files)))
         output_mung = runner.run(image_file, input_mung)
-        with open(output_mung_file, 'w') as file:
-            file.write(export_cropobject_list(output_mung.cropobjects))
+        with open(output_mung_file, 'wb', buffering=OUTPUT_BUFFER_SIZE) as file:
+            write_cropobject_list(output_mung.cropobjects, file)
 
         precision, recall, f1_score, true_positives, false_positives, false_negatives = \
             evaluate_result(ground_truth_mung_file, output_mung_file)
@@ -269,11 +317,13 @@ if __name__ == '__main__':
             with open("output.midi", 'wb') as stream_out:
                 mf.writeFile(stream_out)
 
+    # pandas is only needed for the results table
+    import pandas as pd
     results = pd.DataFrame(results,
                            columns=["Filename", "Precision", "Recall", "F1-Score", "True Positives", "False Positives",
                                     "False Negatives"])
 
     results.to_csv("results.csv", float_format="%.5f", index=False)
 
-    end_time = time.time()
+    end_time = time.perf_counter()
     logging.info('run.py done in {0:.3f} s'.format(end_time - start_time))
@@ -80,7 +80,7 @@ def build_argument_parser():
 
 
 def main(args):
-    _start_time = time.time()
+    _start_time = time.perf_counter()
 
     mung_linker_network = select_model(args.model, args.batch_size)
 
@@ -155,7 +155,7 @@ def main(args):
     print('Saving model to: {0}'.format(args.export))
     torch.save(mung_linker_network.state_dict(), args.export)
 
-    _end_time = time.time()
+    _end_time = time.perf_counter()
     print('train.py done in {0:.3f} s'.format(_end_time - _start_time))
 
 
@@ -1,4 +1,5 @@
 import datetime
+import functools
 import logging
 import os
 
@@ -375,7 +376,10 @@ def show_onset_sequence_predictions(X_var, y_true_var, net, max_items=1):
     plt.show()
 
 
+@functools.lru_cache(maxsize=4)
 def load_grammar(filename):
+    """Loads the grammar and its class list. The grammar is cached per
+    filename, so repeated calls return the same (shared) object."""
     mungo_classes_file = os.path.splitext(filename)[0] + '.xml'
     mlclass_dict = {m.name: m for m in parse_cropobject_class_list(mungo_classes_file)}
     g = DependencyGrammar(grammar_filename=filename, alphabet=list(mlclass_dict.keys()))